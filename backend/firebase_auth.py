@@ -1,27 +1,47 @@
 import os
-import firebase_admin
-from firebase_admin import auth, credentials
-from fastapi import HTTPException, Security
-from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+import time
+from fastapi import HTTPException, Request
 from dotenv import load_dotenv
+from cachetools import TTLCache
 
 load_dotenv()
 
 # Path to your NEW serviceAccountKey.json
 service_account_path = os.path.join(os.path.dirname(__file__), "serviceAccountKey.json")
 
-if not firebase_admin._apps:
-    cred = credentials.Certificate(service_account_path)
-    firebase_admin.initialize_app(cred)
+def init_firebase():
+    """Initializes the Firebase Admin app once; called from the FastAPI lifespan."""
+    import firebase_admin
+    from firebase_admin import credentials
 
-security = HTTPBearer()
+    if not firebase_admin._apps:
+        cred = credentials.Certificate(service_account_path)
+        firebase_admin.initialize_app(cred)
 
-async def verify_firebase_token(res: HTTPAuthorizationCredentials = Security(security)):
+# Decoded tokens keyed by raw JWT; entries are also dropped once near their own 'exp'
+TOKEN_CACHE_TTL = 300
+TOKEN_EXPIRY_SKEW = 30
+_TOKEN_CACHE = TTLCache(maxsize=10_000, ttl=TOKEN_CACHE_TTL)
+
+async def verify_firebase_token(request: Request) -> dict:
     """Verifies the token from the new Firebase project."""
-    token = res.credentials
+    auth_header = request.headers.get("authorization")
+    if not auth_header or auth_header[:7].lower() != "bearer ":
+        raise HTTPException(status_code=401, detail="Missing Neural Link Token")
+    token = auth_header[7:]
+    cached = _TOKEN_CACHE.get(token)
+    if cached is not None:
+        if cached["exp"] - TOKEN_EXPIRY_SKEW > time.time():
+            return cached
+        _TOKEN_CACHE.pop(token, None)
+
+    from firebase_admin import auth
+
     try:
         # This confirms the token was issued by your new project
         decoded_token = auth.verify_id_token(token)
+        if decoded_token["exp"] - TOKEN_EXPIRY_SKEW > time.time():
+            _TOKEN_CACHE[token] = decoded_token
         return decoded_token
     except Exception as e:
         print(f"Neural Handshake Failed: {str(e)}")
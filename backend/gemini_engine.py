@@ -1,9 +1,9 @@
 import os
-import json
 from dotenv import load_dotenv
 from google import genai
 from pathlib import Path
-from typing import Optional, Dict
+from typing import Optional, Dict, List
+from pydantic import BaseModel, ConfigDict, ValidationError, field_validator
 
 # Load .env once
 ROOT_DIR = Path(__file__).resolve().parent.parent
@@ -23,11 +23,46 @@ def get_client():
         _client = genai.Client(api_key=api_key)
     return _client
 
-def analyze_resume(resume_text: str, target_role: str, known_skills: Optional[str] = "") -> Dict:
-    client = get_client()
+class PlanTask(BaseModel):
+    """One roadmap day; Gemini sometimes leaves links null or emits numbers."""
+    model_config = ConfigDict(extra="allow", coerce_numbers_to_str=True)
+
+    day: Optional[str] = None
+    topic: Optional[str] = None
+    description: Optional[str] = None
+    video: Optional[str] = None
+    practice: Optional[str] = None
+    docs: Optional[str] = None
+
+# Gemini's {duration: [task, ...]} roadmap, shared with the cache-hit validation in main.py
+PreparationPlans = Dict[str, List[PlanTask]]
+
+class AnalysisResult(BaseModel):
+    """Shape the analyze prompt's RESPONSE SCHEMA promises; anything else is rejected."""
+    model_config = ConfigDict(coerce_numbers_to_str=True)
+
+    readiness_score: int
+    skills: List[str]
+    required_skills: List[str]
+    missing_skills: List[str]
+    eligible_roles: List[str] = []
+    salary_tiers: Dict[str, Optional[str]] = {}
+    preparation_plans: PreparationPlans
 
-    # Refined prompt to include "Eligible Roles" logic
-    prompt = f"""
+    @field_validator("readiness_score", mode="before")
+    @classmethod
+    def _round_score(cls, value):
+        # Accept 72.5 / "72.5" / "72%" the way the old int(...) cast did, rounding instead of truncating
+        if isinstance(value, str):
+            value = value.strip().rstrip("%")
+        try:
+            return round(float(value))
+        except (TypeError, ValueError, OverflowError):
+            # Only ValueError becomes a ValidationError (-> 502); null/list/inf must not leak as 503s
+            raise ValueError(f"readiness_score must be a finite number, got {value!r}")
+
+# Refined prompt to include "Eligible Roles" logic
+_PROMPT_TEMPLATE = """
         You are an elite Career Strategy Engine with deep expertise in global tech markets and recruitment algorithms. 
         Analyze the inputs provided to generate a high-fidelity, actionable job readiness report.
 
@@ -74,8 +109,17 @@ def analyze_resume(resume_text: str, target_role: str, known_skills: Optional[st
         }}
     """
 
+async def analyze_resume(resume_text: str, target_role: str, known_skills: Optional[str] = "") -> Dict:
+    client = get_client()
+
+    prompt = _PROMPT_TEMPLATE.format(
+        target_role=target_role,
+        resume_text=resume_text,
+        known_skills=known_skills or ""
+    )
+
     try:
-        response = client.models.generate_content(
+        response = await client.aio.models.generate_content(
             model=MODEL,
             contents=prompt,
             config={
@@ -84,8 +128,10 @@ def analyze_resume(resume_text: str, target_role: str, known_skills: Optional[st
             }
         )
         
-        return json.loads(response.text)
+        return AnalysisResult.model_validate_json(response.text).model_dump()
 
+    except ValidationError:
+        raise
     except Exception as e:
         return {
             "error": "AI Analysis Failed",
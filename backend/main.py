@@ -1,18 +1,25 @@
 import os
+import uuid
+import hashlib
 import logging
+import httpx
+import orjson
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks
+from datetime import datetime, timedelta, timezone
+from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, ValidationError
+from cachetools import TTLCache
 from typing import Optional, List, Dict, Any
 
 # Internal project imports
-from backend.gemini_engine import analyze_resume, get_client, MODEL
-from backend.firebase_auth import verify_firebase_token
-from supabase import acreate_client, AsyncClient
-
-from pydantic import BaseModel
-from typing import List, Optional
+from backend.gemini_engine import analyze_resume, get_client, PreparationPlans, MODEL
+from backend.firebase_auth import init_firebase, verify_firebase_token
+from supabase import acreate_client, AsyncClient, AsyncClientOptions
+from postgrest.types import ReturnMethod
+from postgrest.exceptions import APIError
 
 # --- SETUP & LOGGING ---
 logging.basicConfig(level=logging.INFO)
@@ -20,65 +27,237 @@ logger = logging.getLogger("CareerGPT")
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+# Comma-separated frontend origins; defaults to the local static frontend, "*" must be set explicitly
+DEFAULT_CORS_ORIGINS = "http://127.0.0.1:5500,http://localhost:5500"
+CORS_ORIGINS = [o.strip() for o in os.getenv("CORS_ORIGINS", DEFAULT_CORS_ORIGINS).split(",") if o.strip()]
+
+# --- PROMPTS ---
+_EXPLAIN_TEMPLATE = (
+    "You are a Senior Technical Mentor. Explain the topic '{topic}' "
+    "clearly for a student. Context: {description}. "
+    "Use bullet points, keep it under 150 words, and focus on practical application."
+)
+
+_PERSONA_TEMPLATE = (
+    "You are a Senior Technical Lead at a top-tier tech company. "
+    "You are conducting a technical interview for the role of {target_role}. "
+    "STRICT RULES: "
+    "1. Ask exactly ONE technical question at a time. "
+    "2. Evaluate the user's previous answer briefly (2 sentences max). "
+    "3. Progress from fundamental concepts to complex architecture. "
+    "4. If the user's answer is weak, ask a clarifying follow-up. "
+    "5. Maintain a professional, slightly intimidating but fair tone."
+)
+
+# Identical (model, role, skills, resume) submissions reuse a stored analysis for this long
+ANALYSIS_CACHE_TTL = timedelta(days=30)
+
+# Column projections for the read endpoints (the plans JSONB is only sent for a single record)
+RECORD_SUMMARY_COLUMNS = "id,target_role,readiness_score,created_at"
+PROGRESS_COLUMNS = "day_label,duration_type,is_completed,skill_score"
+
+# Per-user Vault summaries, invalidated whenever that user's analyses change.
+# The generation counter stops a query that raced an invalidation from re-caching stale rows;
+# it only has to outlive an in-flight query, so it is bounded and expires with twice the records TTL.
+RECORDS_CACHE_TTL = 60
+_RECORDS_CACHE: TTLCache = TTLCache(maxsize=10_000, ttl=RECORDS_CACHE_TTL)
+_RECORDS_GENERATION: TTLCache = TTLCache(maxsize=10_000, ttl=2 * RECORDS_CACHE_TTL)
+
+# Live interview chats keyed by (uid, session_id); idle sessions expire after an hour
+_SESSIONS: TTLCache = TTLCache(maxsize=1000, ttl=3600)
+
+# PostgREST error code when a called function is not in its schema cache
+RPC_NOT_FOUND = "PGRST202"
+
+# Shared HTTP/2 pool handed to supabase-py, so it survives PostgREST client rebuilds.
+# supabase>=2.32 is required: older postgrest/storage3 rewrite base_url on the injected client.
+SUPABASE_HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+SUPABASE_HTTP_TIMEOUT = 30
 
 class State:
     supabase: Optional[AsyncClient] = None
+    http: Optional[httpx.AsyncClient] = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    init_firebase()
     if SUPABASE_URL and SUPABASE_KEY:
-        State.supabase = await acreate_client(SUPABASE_URL, SUPABASE_KEY)
+        State.http = httpx.AsyncClient(
+            http2=True,
+            follow_redirects=True,
+            limits=SUPABASE_HTTP_LIMITS,
+            timeout=SUPABASE_HTTP_TIMEOUT,
+        )
+        State.supabase = await acreate_client(
+            SUPABASE_URL, SUPABASE_KEY, options=AsyncClientOptions(httpx_client=State.http)
+        )
         logger.info("Async Supabase client initialized.")
     yield
     if State.supabase:
         await State.supabase.auth.sign_out()
+    if State.http:
+        await State.http.aclose()
+
+# Streamed Gemini routes: gzip would hold tokens back until its compressor flushes
+_UNCOMPRESSED_PATHS = {"/explain-task", "/mock-interview"}
+
+class _StreamAwareGZipMiddleware(GZipMiddleware):
+    """Gzips regular responses but passes the token-streaming routes through untouched."""
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in _UNCOMPRESSED_PATHS:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+app = FastAPI(title="CareerGPT API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
-app = FastAPI(title="CareerGPT API", lifespan=lifespan)
+app.add_middleware(_StreamAwareGZipMiddleware, minimum_size=1024)
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=CORS_ORIGINS,
     allow_headers=["*"],
     allow_methods=["*"],
+    max_age=86400,
 )
 
 # --- MODELS ---
-class AnalyzeRequest(BaseModel):
+class _RequestModel(BaseModel):
+    """Request bodies are read-only; unknown client fields are dropped."""
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
+class AnalyzeRequest(_RequestModel):
     resume_text: str = Field(..., min_length=50)
     target_role: str = Field(...)
     known_skills: Optional[str] = ""
 
-class ProgressUpdate(BaseModel):
+class ProgressUpdate(_RequestModel):
     analysis_id: str
     day_label: str
     is_completed: bool
     duration_type: str = "30"
     skill_score: int = Field(5, ge=0, le=5)
 
-class ExplainRequest(BaseModel):
+class ExplainRequest(_RequestModel):
     topic: str
     description: str
 
+class InterviewMessage(_RequestModel):
+    role: str # "user" or "model"
+    content: str
+
+class InterviewRequest(_RequestModel):
+    session_id: str
+    target_role: str
+    last_answer: str
+    history: List[dict] = [] # List of {q: str, a: str}, used to rebuild an expired session
+
+# Re-validates plans served from analysis_cache (fresh analyses are checked in analyze_resume)
+_PLANS_ADAPTER = TypeAdapter(PreparationPlans)
+
+# --- HELPERS ---
+def _analysis_cache_key(resume_text: str, target_role: str, known_skills: Optional[str]) -> str:
+    """Content hash identifying an analyze request for the shared result cache."""
+    payload = f"{MODEL}|{target_role}|{known_skills or ''}|{resume_text}"
+    return hashlib.blake2b(payload.encode(), digest_size=32).hexdigest()
+
+async def _get_cached_analysis(key: str) -> Optional[Dict]:
+    """Returns a fresh cached analysis for this hash, or None on miss/error."""
+    if not State.supabase: return None
+    cutoff = (datetime.now(timezone.utc) - ANALYSIS_CACHE_TTL).isoformat()
+    try:
+        res = await State.supabase.table("analysis_cache").select("result")\
+            .eq("hash", key).gte("created_at", cutoff).limit(1).execute()
+    except Exception as e:
+        logger.warning(f"Analysis Cache Lookup Error: {e}")
+        return None
+    return res.data[0]["result"] if res.data else None
+
+async def _store_cached_analysis(key: str, result: Dict):
+    """Records a Gemini analysis under its content hash; first writer wins."""
+    try:
+        await State.supabase.table("analysis_cache").upsert(
+            {"hash": key, "result": result},
+            on_conflict="hash",
+            ignore_duplicates=True
+        ).execute()
+    except Exception as e:
+        logger.warning(f"Analysis Cache Store Error: {e}")
+
+def _invalidate_records(user_id: str):
+    """Drops a user's cached Vault list and fences off any in-flight refill."""
+    _RECORDS_GENERATION[user_id] = _RECORDS_GENERATION.get(user_id, 0) + 1
+    _RECORDS_CACHE.pop(user_id, None)
+
+async def _first_chunk(stream):
+    """Pulls the first chunk so request errors raise before the response starts."""
+    try:
+        return await stream.__anext__()
+    except StopAsyncIteration:
+        return None
+
+async def _stream_text(stream, label: str, first=None):
+    """Relays Gemini chunks to the client; mid-stream failures end the body early."""
+    try:
+        if first is not None and first.text:
+            yield first.text.encode()
+        async for chunk in stream:
+            if chunk.text:
+                yield chunk.text.encode()
+    except Exception as e:
+        logger.error(f"{label}: {e}")
+
 # --- ENDPOINTS ---
 
 @app.post("/analyze")
-async def analyze(req: AnalyzeRequest, user=Depends(verify_firebase_token)):
+async def analyze(req: AnalyzeRequest, background_tasks: BackgroundTasks, user=Depends(verify_firebase_token)):
     """Generates career analysis and seeds all roadmap durations."""
     try:
-        # 1. AI Analysis Call
-        analysis_result = analyze_resume(req.resume_text, req.target_role, req.known_skills)
-        
-        # Handle AI Rate Limits (503 handling matched with Dashboard logic)
-        if "error" in analysis_result:
-            status = 429 if "429" in str(analysis_result["error"]) else 503
-            raise HTTPException(status_code=status, detail=analysis_result["details"])
+        # 1. AI Analysis Call (skipped when this exact submission was analyzed recently)
+        cache_key = _analysis_cache_key(req.resume_text, req.target_role, req.known_skills)
+        analysis_result = await _get_cached_analysis(cache_key)
+
+        if analysis_result is not None:
+            plans = _PLANS_ADAPTER.validate_python(analysis_result.get("preparation_plans", {}))
+            analysis_result["preparation_plans"] = _PLANS_ADAPTER.dump_python(plans)
+        else:
+            analysis_result = await analyze_resume(req.resume_text, req.target_role, req.known_skills)
+
+            # Handle AI Rate Limits (503 handling matched with Dashboard logic)
+            if "error" in analysis_result:
+                status = 429 if "429" in str(analysis_result["error"]) else 503
+                raise HTTPException(status_code=status, detail=analysis_result["details"])
+
+            if State.supabase:
+                background_tasks.add_task(_store_cached_analysis, cache_key, dict(analysis_result))
 
         user_id = user.get("uid")
         
         if State.supabase:
-            # 2. Insert mission into 'analyses' table
-            db_res = await State.supabase.table("analyses").insert({
-                "user_id": str(user_id),
+            # 2. Mint the mission id locally so the roadmap rows can reference it in the same commit
+            analysis_id = str(uuid.uuid4())
+            analysis_result["id"] = analysis_id
+
+            # 3. Optimized Seeding: Seed ALL plans (30, 60, 90) for the Roadmap grid
+            plans = analysis_result.get("preparation_plans", {})
+            uid, aid = str(user_id), analysis_id
+            progress_rows = [
+                {
+                    "analysis_id": aid,
+                    "user_id": uid,
+                    "day_label": task["day"],
+                    "duration_type": duration,
+                    "is_completed": False,
+                    "skill_score": 5
+                }
+                for duration, tasks in plans.items()
+                for task in tasks
+                if task.get("day")
+            ]
+
+            analysis_row = {
+                "id": analysis_id,
+                "user_id": uid,
                 "target_role": str(req.target_role),
                 "eligible_roles": analysis_result.get("eligible_roles", []), 
                 "readiness_score": int(analysis_result.get("readiness_score", 0)),
@@ -87,38 +266,30 @@ async def analyze(req: AnalyzeRequest, user=Depends(verify_firebase_token)):
                 "missing_skills": analysis_result.get("missing_skills", []), 
                 "salary_tiers": analysis_result.get("salary_tiers", {}), 
                 "preparation_plans": analysis_result.get("preparation_plans", {}) 
-            }).execute()
-            
-            if not db_res.data:
-                raise HTTPException(status_code=500, detail="Database Sync Failed.")
+            }
 
-            analysis_id = db_res.data[0]["id"]
-            analysis_result["id"] = analysis_id
-
-            # 3. Optimized Seeding: Seed ALL plans (30, 60, 90) for the Roadmap grid
-            plans = analysis_result.get("preparation_plans", {})
-            progress_rows = []
-
-            for duration, tasks in plans.items():
-                for task in tasks:
-                    progress_rows.append({
-                        "analysis_id": str(analysis_id),
-                        "user_id": str(user_id),
-                        "day_label": str(task.get("day")),
-                        "duration_type": str(duration),
-                        "is_completed": False,
-                        "skill_score": 5 
-                    })
-            
-            if progress_rows:
-                await State.supabase.table("roadmap_progress").upsert(
-                    progress_rows, 
-                    on_conflict="user_id,analysis_id,day_label,duration_type"
-                ).execute()
+            # 4. Commit mission + roadmap seed in one transaction via the analyze_commit RPC
+            try:
+                await State.supabase.rpc("analyze_commit", {
+                    "p_user": uid,
+                    "p_analysis": analysis_row,
+                    "p_rows": progress_rows
+                }).execute()
+            except APIError as e:
+                if e.code == RPC_NOT_FOUND:
+                    logger.error("analyze_commit RPC missing: apply backend/schema.sql to the Supabase project")
+                else:
+                    logger.error(f"Mission Commit Error: {e}")
+                raise HTTPException(status_code=500, detail="Database Sync Failed.")
+            _invalidate_records(uid)
 
         return analysis_result
     except HTTPException as he:
         raise he
+    except ValidationError as ve:
+        # Rejected before any DB write so a broken mission never gets seeded
+        logger.error(f"Malformed AI Schema: {ve}")
+        raise HTTPException(status_code=502, detail="AI returned malformed schema")
     except Exception as e:
         logger.error(f"Neural Backend Crash: {e}")
         raise HTTPException(status_code=500, detail="Internal processing error.")
@@ -151,121 +322,99 @@ async def get_progress(analysis_id: str, user=Depends(verify_firebase_token)):
     """Retrieves progress data for the Competency Radar"""
     if not State.supabase: return []
     user_id = user.get("uid")
-    res = await State.supabase.table(   "roadmap_progress").select("*")\
+    res = await State.supabase.table("roadmap_progress").select(PROGRESS_COLUMNS)\
         .eq("analysis_id", analysis_id).eq("user_id", user_id).execute()
     return res.data
 
 @app.get("/learning-records")
-async def get_records(user=Depends(verify_firebase_token)):
-    """Fetches mission history for the Sidebar Vault"""
+async def get_records(request: Request, user=Depends(verify_firebase_token)):
+    """Fetches mission summaries for the Sidebar Vault"""
     if not State.supabase: return []
     user_id = user.get("uid")
+
+    cached = _RECORDS_CACHE.get(user_id)
+    if cached is None:
+        generation = _RECORDS_GENERATION.get(user_id, 0)
+        res = await State.supabase.table("analyses").select(RECORD_SUMMARY_COLUMNS)\
+            .eq("user_id", user_id).order("created_at", desc=True).execute()
+        body = orjson.dumps(res.data)
+        cached = (f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"', body)
+        if _RECORDS_GENERATION.get(user_id, 0) == generation:
+            _RECORDS_CACHE[user_id] = cached
+
+    # Browsers revalidate with the ETag every time, so a fresh analysis shows up immediately
+    etag, body = cached
+    headers = {"Cache-Control": "private, no-cache", "ETag": etag}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/learning-records/{record_id}")
+async def get_record(record_id: str, user=Depends(verify_firebase_token)):
+    """Fetches one full mission (plans included) when it is opened from the Vault"""
+    if not State.supabase:
+        raise HTTPException(status_code=500, detail="Supabase offline")
+    user_id = user.get("uid")
     res = await State.supabase.table("analyses").select("*")\
-        .eq("user_id", user_id).order("created_at", desc=True).execute()
-    return res.data
+        .eq("id", record_id).eq("user_id", user_id).limit(1).execute()
+    if not res.data:
+        raise HTTPException(status_code=404, detail="Record not found.")
+    return res.data[0]
 
 @app.delete("/delete-record/{record_id}")
 async def delete_record(record_id: str, user=Depends(verify_firebase_token)):
     """Erase specific mission data from the vault"""
     user_id = user.get("uid")
-    await State.supabase.table("analyses").delete().eq("id", record_id).eq("user_id", user_id).execute()
+    await State.supabase.table("analyses").delete(returning=ReturnMethod.minimal)\
+        .eq("id", record_id).eq("user_id", user_id).execute()
+    _invalidate_records(user_id)
     return {"status": "success"}
 
 @app.post("/explain-task")
 async def explain_task(req: ExplainRequest, user=Depends(verify_firebase_token)):
-    """AI Mentor: Provides technical deep dives"""
+    """AI Mentor: Provides technical deep dives, streamed as plain text"""
+    fallback = "Neural Link offline. The AI Mentor is currently recalibrating."
     try:
         client = get_client() 
-        prompt = (
-            f"You are a Senior Technical Mentor. Explain the topic '{req.topic}' "
-            f"clearly for a student. Context: {req.description}. "
-            "Use bullet points, keep it under 150 words, and focus on practical application."
-        )
+        prompt = _EXPLAIN_TEMPLATE.format(topic=req.topic, description=req.description)
         # Uses the global MODEL defined in your engine
-        response = client.models.generate_content(model=MODEL, contents=prompt)
-        return {"explanation": response.text}
+        stream = await client.aio.models.generate_content_stream(model=MODEL, contents=prompt)
     except Exception as e:
         logger.error(f"AI Mentor Error: {e}")
-        return {"explanation": "Neural Link offline. The AI Mentor is currently recalibrating."}
-class InterviewRequest(BaseModel):
-    target_role: str
-    last_answer: str = ""
-    history: list = []
+        return StreamingResponse(iter([fallback]), media_type="text/plain")
 
-@app.post("/mock-interview")
-async def mock_interview(req: InterviewRequest, user=Depends(verify_firebase_token)):
-    """Simulates a technical interview session."""
-    try:
-        client = get_client()
-        
-        system_instruction = (
-            f"You are a Senior Technical Interviewer for the role of {req.target_role}. "
-            "Your goal is to assess the candidate's depth of knowledge. "
-            "1. Ask only ONE technical question at a time. "
-            "2. If the user provides an answer, give a brief 1-sentence feedback and then ask a follow-up or new question. "
-            "3. Keep the conversation professional and challenging. "
-            "4. If the user says 'start', ask the first introductory technical question."
-        )
-
-        # Build the conversation history
-        messages = [{"role": "user", "parts": [system_instruction]}]
-        for entry in req.history:
-            messages.append({"role": "user", "parts": [entry['q']]})
-            messages.append({"role": "model", "parts": [entry['a']]})
-        
-        input_text = req.last_answer if req.last_answer else "Let's start the interview."
-        
-        response = client.models.generate_content(
-            model=MODEL,
-            contents=input_text,
-            config={'system_instruction': system_instruction}
-        )
-        
-        return {"question": response.text}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    
-class InterviewMessage(BaseModel):
-    role: str # "user" or "model"
-    content: str
-
-class InterviewRequest(BaseModel):
-    target_role: str
-    last_answer: str
-    history: List[dict] # List of {q: str, a: str}
+    return StreamingResponse(_stream_text(stream, "AI Mentor Error"), media_type="text/plain")
 
 @app.post("/mock-interview")
 async def mock_interview(req: InterviewRequest, user=Depends(verify_firebase_token)):
-    """Engine for the Technical Simulation."""
+    """Engine for the Technical Simulation, streamed as plain text."""
     try:
-        client = get_client()
-        
-        # Define the AI Persona
-        persona = (
-            f"You are a Senior Technical Lead at a top-tier tech company. "
-            f"You are conducting a technical interview for the role of {req.target_role}. "
-            "STRICT RULES: "
-            "1. Ask exactly ONE technical question at a time. "
-            "2. Evaluate the user's previous answer briefly (2 sentences max). "
-            "3. Progress from fundamental concepts to complex architecture. "
-            "4. If the user's answer is weak, ask a clarifying follow-up. "
-            "5. Maintain a professional, slightly intimidating but fair tone."
-        )
+        session_key = (user.get("uid"), req.session_id)
+        chat = _SESSIONS.get(session_key)
 
-        # Reconstruct the conversation context for Gemini
-        chat_context = f"Target Role: {req.target_role}\n"
-        for entry in req.history:
-            chat_context += f"Interviewer: {entry['q']}\nCandidate: {entry['a']}\n"
-        
-        chat_context += f"Candidate's latest response: {req.last_answer}"
+        if chat is None:
+            # New (or expired) session: seed the chat with the persona and any prior turns
+            history = []
+            for entry in req.history:
+                if not entry.get('q') or not entry.get('a'):
+                    continue
+                history.append({"role": "user", "parts": [{"text": entry['a']}]})
+                history.append({"role": "model", "parts": [{"text": entry['q']}]})
 
-        response = client.models.generate_content(
-            model=MODEL,
-            contents=chat_context,
-            config={'system_instruction': persona}
-        )
+            chat = get_client().aio.chats.create(
+                model=MODEL,
+                config={'system_instruction': _PERSONA_TEMPLATE.format(target_role=req.target_role)},
+                history=history
+            )
 
-        return {"question": response.text}
+        # The chat only sends its request on first iteration, so pull that chunk here
+        stream = await chat.send_message_stream(req.last_answer)
+        first = await _first_chunk(stream)
+
+        # Re-store on every successful turn: TTLCache expiry counts from the last write, not the last read
+        _SESSIONS[session_key] = chat
     except Exception as e:
         logger.error(f"Interview Error: {e}")
-        raise HTTPException(status_code=500, detail="Neural link failed.")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Neural link failed.")
+
+    return StreamingResponse(_stream_text(stream, "Interview Error", first), media_type="text/plain")
@@ -0,0 +1,49 @@
+-- Supabase schema additions used by backend/main.py.
+-- Apply in the Supabase SQL editor; statements are idempotent.
+
+-- Content-addressed cache of Gemini analyses (see _analysis_cache_key).
+CREATE TABLE IF NOT EXISTS analysis_cache (
+    hash TEXT PRIMARY KEY,
+    result JSONB NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+-- Resume-derived data: RLS with no policies hides it from anon/authenticated;
+-- the backend's service role bypasses RLS.
+ALTER TABLE analysis_cache ENABLE ROW LEVEL SECURITY;
+
+-- Serve the Vault list from an index scan. Progress lookups by
+-- (user_id, analysis_id) already use the prefix of the unique
+-- (user_id, analysis_id, day_label, duration_type) key behind on_conflict.
+CREATE INDEX IF NOT EXISTS analyses_user_created_idx
+    ON analyses (user_id, created_at DESC);
+
+-- Writes an analysis and seeds its roadmap progress in one transaction
+-- (called from /analyze via supabase.rpc("analyze_commit", ...)).
+CREATE OR REPLACE FUNCTION analyze_commit(p_user text, p_analysis jsonb, p_rows jsonb)
+RETURNS uuid AS $$
+DECLARE
+    aid uuid;
+BEGIN
+    INSERT INTO analyses (
+        id, user_id, target_role, eligible_roles, readiness_score, skills,
+        required_skills, missing_skills, salary_tiers, preparation_plans
+    )
+    SELECT a.id, p_user, a.target_role, a.eligible_roles, a.readiness_score, a.skills,
+           a.required_skills, a.missing_skills, a.salary_tiers, a.preparation_plans
+    FROM jsonb_populate_record(NULL::analyses, p_analysis) a
+    RETURNING id INTO aid;
+
+    INSERT INTO roadmap_progress (
+        analysis_id, user_id, day_label, duration_type, is_completed, skill_score
+    )
+    SELECT aid, p_user, r.day_label, r.duration_type, r.is_completed, r.skill_score
+    FROM jsonb_populate_recordset(NULL::roadmap_progress, p_rows) r
+    ON CONFLICT (user_id, analysis_id, day_label, duration_type) DO NOTHING;
+
+    RETURN aid;
+END;
+$$ LANGUAGE plpgsql;
+
+-- p_user is trusted, so only the backend's service key may call this.
+REVOKE EXECUTE ON FUNCTION analyze_commit(text, jsonb, jsonb) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION analyze_commit(text, jsonb, jsonb) TO service_role;
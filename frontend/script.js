@@ -213,8 +213,25 @@ async function loadHistory() {
     }
 }
 
-function handleHistoryClick(index) {
-    const record = analysisHistoryCache[index];
+async function handleHistoryClick(index) {
+    const summary = analysisHistoryCache[index];
+    if (!summary) return;
+
+    // The sidebar list only carries summaries; pull the full mission on demand
+    let record;
+    try {
+        const session = await getVerifiedSession();
+        if (!session) return;
+        const res = await fetch(`http://127.0.0.1:8000/learning-records/${summary.id}`, {
+            headers: { 'Authorization': 'Bearer ' + session.token }
+        });
+        if (!res.ok) throw new Error("Record fetch failed");
+        record = await res.json();
+    } catch (e) {
+        console.error("History load error:", e);
+        return;
+    }
+
     if (record) {
         localStorage.setItem('currentAnalysisId', record.id);
         localStorage.setItem('currentRoadmap', JSON.stringify(record.preparation_plans || {}));